@@ -1,29 +1,80 @@
+import hashlib
 import secrets
+from datetime import timedelta
 from functools import wraps
 from flask import (
     flash,
     Flask,
     g,
+    get_flashed_messages,
+    jsonify,
+    make_response,
     redirect,
     render_template,
     request,
+    session,
+    stream_template,
     url_for,
 )
-from werkzeug.exceptions import NotFound
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.exceptions import BadRequest, NotFound
 from todos.utils import (
     error_for_list_title, 
     error_for_todo, 
-    find_todo_by_id,
     is_list_completed,
     is_todo_completed,
+    list_stats,
     sort_items,
-    todos_remaining,
 )
-from todos.database_persistence import DatabasePersistence
+from todos.cache import cache
+from todos.database_persistence import DatabasePersistence, SCHEMA_VERSION
 import os
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
+# Workers must share the key, or a session cookie signed by one worker is
+# rejected by the next. The random fallback only suits a single dev process.
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = timedelta(days=1)
+if os.environ.get('FLASK_ENV') == 'production':
+    # Fail at boot rather than fall back to a per-worker key.
+    app.secret_key = os.environ['SECRET_KEY']
+    app.config['SESSION_COOKIE_SECURE'] = True
+    # Templates only change on deploy; skip the per-render stat() calls.
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+
+# Compiled templates are shared on disk across workers and restarts.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+    os.environ.get('JINJA_CACHE_DIR'))
+
+if os.environ.get('REDIS_URL'):
+    app.config['CACHE_TYPE'] = 'RedisCache'
+    app.config['CACHE_REDIS_URL'] = os.environ['REDIS_URL']
+elif os.environ.get('FLASK_ENV') == 'production':
+    # A per-process cache would go stale across gunicorn workers.
+    app.config['CACHE_TYPE'] = 'NullCache'
+else:
+    app.config['CACHE_TYPE'] = 'SimpleCache'
+app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+# Cached rows have the shape of the schema they were read from.
+app.config['CACHE_KEY_PREFIX'] = f'todos:v{SCHEMA_VERSION}:'
+cache.init_app(app)
+
+def _release_tag():
+    # Part of every ETag, so a deploy that changes the templates or sets a
+    # new RELEASE invalidates pages browsers already hold.
+    digest = hashlib.md5(os.environ.get('RELEASE', '').encode(),
+                         usedforsecurity=False)
+    for name in sorted(app.jinja_env.list_templates()):
+        source, _, _ = app.jinja_loader.get_source(app.jinja_env, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+RELEASE_TAG = _release_tag()
+
+@app.cli.command('init-db')
+def init_db_command():
+    DatabasePersistence.initialize_schema()
 
 def require_list(f):
     @wraps(f)
@@ -36,22 +87,49 @@ def require_list(f):
 
     return decorated_function
 
+def require_list_exists(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        list_id = kwargs.get('list_id')
+        if not g.storage.list_exists(list_id):
+            raise NotFound(description="List not found")
+        return f(*args, **kwargs)
+
+    return decorated_function
+
 def require_todo(f):
     @wraps(f)
-    @require_list
-    def decorated_function(lst, *args, **kwargs):
+    def decorated_function(*args, **kwargs):
+        list_id = kwargs.get('list_id')
         todo_id = kwargs.get('todo_id')
-        todo = find_todo_by_id(todo_id, lst['todos'])
+        todo = g.storage.find_todo(list_id, todo_id)
         if not todo:
             raise NotFound(description="Todo not found")
-        return f(lst=lst, todo=todo, *args, **kwargs)
+        return f(todo=todo, *args, **kwargs)
 
     return decorated_function
 
+def render_if_modified(version, render):
+    # A pending flash message must be shown exactly once, so such pages are
+    # always rendered and never get an ETag a later 304 could replay.
+    if session.get('_flashes'):
+        return render()
+
+    etag = hashlib.md5(f'{RELEASE_TAG}:{version}'.encode(),
+                       usedforsecurity=False).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
 @app.context_processor
 def list_utilities_processor():
     return dict(
         is_list_completed=is_list_completed,
+        list_stats=list_stats,
     )
 
 @app.before_request
@@ -64,16 +142,24 @@ def index():
 
 @app.route("/lists")
 def get_lists():
-    lists = sort_items(g.storage.all_lists(), is_list_completed)
-    return render_template('lists.html',
-                           lists=lists,
-                           todos_remaining=todos_remaining)
+    lists = g.storage.all_lists()
+
+    def render():
+        # The session cookie goes out before a streamed body is rendered, so
+        # pop the flashes now; the template then reads the cached copy.
+        get_flashed_messages(with_categories=True)
+        return stream_template('lists.html', lists=lists)
+
+    # Versioned from the rows being rendered, so the ETag always matches
+    # the body even when that body came from the cache.
+    version = [(lst['id'], lst['version']) for lst in lists]
+    return render_if_modified(version, render)
 
 @app.route("/lists", methods=["POST"])
 def create_list():
     title = request.form["list_title"].strip()
 
-    error = error_for_list_title(title, g.storage.all_lists())
+    error = error_for_list_title(title, g.storage)
     if error:
         flash(error, "error")
         return render_template('new_list.html', title=title)
@@ -90,17 +176,18 @@ def add_todo_list():
 @require_list
 def show_list(lst, list_id):
     lst['todos'] = sort_items(lst['todos'], is_todo_completed)
-    return render_template('list.html', lst=lst)
+    return render_if_modified(lst['version'],
+                              lambda: render_template('list.html', lst=lst))
 
 @app.route("/lists/<int:list_id>/todos", methods=["POST"])
-@require_list
-def create_todo(lst, list_id):
+@require_list_exists
+def create_todo(list_id):
     todo_title = request.form["todo"].strip()
 
     error = error_for_todo(todo_title)
     if error:
         flash(error, "error")
-        return render_template('list.html', lst=lst)
+        return render_template('list.html', lst=g.storage.find_list(list_id))
 
     g.storage.create_new_todo(list_id, todo_title)
     flash("The todo was added.", "success")
@@ -108,22 +195,39 @@ def create_todo(lst, list_id):
 
 @app.route("/lists/<int:list_id>/todos/<int:todo_id>/toggle", methods=["POST"])
 @require_todo
-def update_todo_status(lst, todo, list_id, todo_id):
-    is_completed = request.form['completed'] == 'True'
-    g.storage.update_todo_status(list_id, todo_id, is_completed)
+def update_todo_status(todo, list_id, todo_id):
+    if g.storage.update_todo_status(list_id, todo_id) is None:
+        raise NotFound(description="Todo not found")
     flash("The todo has been updated.", "success")
     return redirect(url_for('show_list', list_id=list_id))
 
 @app.route("/lists/<int:list_id>/todos/<int:todo_id>/delete", methods=["POST"])
 @require_todo
-def delete_todo(lst, todo, list_id, todo_id):
+def delete_todo(todo, list_id, todo_id):
     g.storage.delete_todo_from_list(list_id, todo_id)
     flash("The todo has been deleted.", "success")
     return redirect(url_for('show_list', list_id=list_id))
 
+@app.route("/lists/<int:list_id>/todos/bulk_toggle", methods=["POST"])
+@require_list_exists
+def bulk_toggle_todos(list_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    todo_ids = data.get('ids')
+    completed = data.get('completed')
+    if (not isinstance(todo_ids, list)
+            or not all(type(todo_id) is int for todo_id in todo_ids)
+            or not isinstance(completed, bool)):
+        raise BadRequest(
+            description='Expected {"ids": [<todo id>, ...], "completed": <bool>}')
+
+    updated = g.storage.set_todos_completed(list_id, todo_ids, completed)
+    return jsonify(updated=updated)
+
 @app.route("/lists/<int:list_id>/complete_all", methods=["POST"])
-@require_list
-def mark_all_todos_completed(lst, list_id):
+@require_list_exists
+def mark_all_todos_completed(list_id):
     g.storage.mark_all_todos_completed(list_id)
     flash("All todos have been updated.", "success")
     return redirect(url_for('show_list', list_id=list_id))
@@ -131,30 +235,34 @@ def mark_all_todos_completed(lst, list_id):
 @app.route("/lists/<int:list_id>/edit")
 @require_list
 def edit_list(lst, list_id):
-    return render_template('edit_list.html', lst=lst)
+    return render_if_modified(lst['version'],
+                              lambda: render_template('edit_list.html', lst=lst))
 
 @app.route("/lists/<int:list_id>/delete", methods=["POST"])
-@require_list
-def delete_list(lst, list_id):
+@require_list_exists
+def delete_list(list_id):
     g.storage.delete_list(list_id)
     flash("The list has been deleted.", "success")
     return redirect(url_for('get_lists'))
 
 @app.route("/lists/<int:list_id>", methods=["POST"])
-@require_list
-def update_list(lst, list_id):
+@require_list_exists
+def update_list(list_id):
     title = request.form["list_title"].strip()
 
-    error = error_for_list_title(title, g.storage.all_lists())
+    error = error_for_list_title(title, g.storage)
     if error:
         flash(error, "error")
-        return render_template('edit_list.html', lst=lst, title=title)
+        return render_template('edit_list.html',
+                               lst=g.storage.find_list(list_id),
+                               title=title)
 
     g.storage.update_list_by_id(list_id, title)
     flash("The list has been updated.", "success")
     return redirect(url_for('show_list', list_id=list_id))
 
 if __name__ == "__main__":
+    DatabasePersistence.initialize_schema()
     if os.environ.get('FLASK_ENV') == 'production':
         app.run(debug=False)
     else:
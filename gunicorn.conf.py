@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+# Each worker has its own connection pool, so split one PostgreSQL
+# connection budget across them: DB_POOL_MAX = DB_MAX_CONNECTIONS // workers.
+# The default budget leaves headroom under PostgreSQL's default
+# max_connections of 100. Workers inherit this environment when forked.
+db_max_connections = int(os.environ.get('DB_MAX_CONNECTIONS', 80))
+
+# cpu_count() sees every core on the host, not the container's CPU limit,
+# so the default is capped at one connection per worker.
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             min(multiprocessing.cpu_count() * 2 + 1,
+                                 db_max_connections)))
+if workers > db_max_connections:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} workers need at least one database "
+        f"connection each, but DB_MAX_CONNECTIONS is {db_max_connections}")
+
+os.environ.setdefault('DB_POOL_MAX', str(db_max_connections // workers))
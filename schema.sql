@@ -1,13 +1,148 @@
-CREATE TABLE lists (
-    id serial PRIMARY KEY,
-    title text NOT NULL UNIQUE
+-- The whole schema, applied by `flask init-db` and at worker boot through
+-- DatabasePersistence.initialize_schema(). The version placeholders are
+-- filled in with SCHEMA_VERSION from todos/database_persistence.py, so run it
+-- through the app rather than psql. Every step is idempotent.
+
+SELECT pg_advisory_xact_lock(hashtext('todos_schema'));
+
+CREATE TABLE IF NOT EXISTS schema_version (
+    version integer NOT NULL
 );
 
-CREATE TABLE todos (
-    id serial PRIMARY KEY,
-    title text NOT NULL,
-    completed boolean NOT NULL DEFAULT false,
-    list_id integer NOT NULL
-                    REFERENCES lists (id)
-                    ON DELETE CASCADE
-);
\ No newline at end of file
+DO $schema$
+BEGIN
+    IF (SELECT max(version) FROM schema_version) >= %(version)s THEN
+        RETURN;
+    END IF;
+
+    CREATE TABLE IF NOT EXISTS lists (
+        id serial PRIMARY KEY,
+        title varchar(100) NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS todos (
+        id serial PRIMARY KEY,
+        title varchar(100) NOT NULL,
+        completed boolean NOT NULL DEFAULT false,
+        list_id integer NOT NULL REFERENCES
+             lists (id) ON DELETE CASCADE
+    );
+
+    CREATE INDEX IF NOT EXISTS todos_list_id_idx
+        ON todos (list_id);
+
+    -- Denormalized todo counts, so /lists never reads todos. Backfilled
+    -- when the columns are added.
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = 'lists'::regclass
+          AND attname = 'pending_count'
+          AND NOT attisdropped
+    ) THEN
+        ALTER TABLE lists
+            ADD COLUMN todos_count integer NOT NULL DEFAULT 0,
+            ADD COLUMN pending_count integer NOT NULL DEFAULT 0;
+        UPDATE lists
+        SET todos_count = counts.total,
+            pending_count = counts.pending
+        FROM (SELECT list_id,
+                     COUNT(*) AS total,
+                     COUNT(*) FILTER (WHERE NOT completed)
+                         AS pending
+              FROM todos
+              GROUP BY list_id) AS counts
+        WHERE lists.id = counts.list_id;
+    END IF;
+
+    -- lists.version goes up by one whenever a list or any of its todos
+    -- changes; it is the version behind the ETags. Unlike a timestamp taken
+    -- at statement start, it cannot go backwards when transactions commit
+    -- out of order.
+    ALTER TABLE lists
+        ADD COLUMN IF NOT EXISTS
+            version integer NOT NULL DEFAULT 1,
+        DROP COLUMN IF EXISTS updated_at;
+
+    CREATE OR REPLACE FUNCTION touch_list()
+    RETURNS trigger AS $fn$
+    BEGIN
+        NEW.version = OLD.version + 1;
+        RETURN NEW;
+    END;
+    $fn$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS lists_touch ON lists;
+    CREATE TRIGGER lists_touch BEFORE UPDATE ON lists
+        FOR EACH ROW EXECUTE FUNCTION touch_list();
+
+    -- Applies a statement's net change to the counts of each affected list;
+    -- that UPDATE also bumps its version.
+    CREATE OR REPLACE FUNCTION touch_lists_of_todos()
+    RETURNS trigger AS $fn$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE lists
+            SET todos_count = todos_count + delta.total,
+                pending_count = pending_count + delta.pending
+            FROM (SELECT list_id,
+                         COUNT(*) AS total,
+                         COUNT(*) FILTER (WHERE NOT completed)
+                             AS pending
+                  FROM new_todos
+                  GROUP BY list_id) AS delta
+            WHERE lists.id = delta.list_id;
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE lists
+            SET todos_count = todos_count - delta.total,
+                pending_count = pending_count - delta.pending
+            FROM (SELECT list_id,
+                         COUNT(*) AS total,
+                         COUNT(*) FILTER (WHERE NOT completed)
+                             AS pending
+                  FROM old_todos
+                  GROUP BY list_id) AS delta
+            WHERE lists.id = delta.list_id;
+        ELSE
+            UPDATE lists
+            SET todos_count = todos_count + delta.total,
+                pending_count = pending_count + delta.pending
+            FROM (SELECT list_id,
+                         SUM(total) AS total,
+                         SUM(pending) AS pending
+                  FROM (SELECT list_id, 1 AS total,
+                               (NOT completed)::integer AS pending
+                        FROM new_todos
+                        UNION ALL
+                        SELECT list_id, -1,
+                               -(NOT completed)::integer
+                        FROM old_todos) AS changes
+                  GROUP BY list_id) AS delta
+            WHERE lists.id = delta.list_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $fn$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS todos_touch_insert ON todos;
+    CREATE TRIGGER todos_touch_insert AFTER INSERT ON todos
+        REFERENCING NEW TABLE AS new_todos
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION touch_lists_of_todos();
+
+    DROP TRIGGER IF EXISTS todos_touch_update ON todos;
+    CREATE TRIGGER todos_touch_update AFTER UPDATE ON todos
+        REFERENCING OLD TABLE AS old_todos
+                    NEW TABLE AS new_todos
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION touch_lists_of_todos();
+
+    DROP TRIGGER IF EXISTS todos_touch_delete ON todos;
+    CREATE TRIGGER todos_touch_delete AFTER DELETE ON todos
+        REFERENCING OLD TABLE AS old_todos
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION touch_lists_of_todos();
+
+    DELETE FROM schema_version;
+    INSERT INTO schema_version VALUES (%(version)s);
+END;
+$schema$;
@@ -0,0 +1,139 @@
+import unittest
+from unittest.mock import patch
+from app import app
+
+class StubStorage:
+    def __init__(self):
+        self.lists = {1: {'id': 1, 'title': 'Groceries', 'version': 1,
+                          'todos': [{'id': 1, 'title': 'milk',
+                                     'completed': False}]}}
+        self.bulk_calls = []
+
+    def all_lists(self):
+        return list(self.lists.values())
+
+    def find_list(self, list_id):
+        return self.lists.get(list_id)
+
+    def list_exists(self, list_id):
+        return list_id in self.lists
+
+    def find_todo(self, list_id, todo_id):
+        lst = self.lists.get(list_id)
+        if lst:
+            return next((todo for todo in lst['todos']
+                         if todo['id'] == todo_id), None)
+        return None
+
+    def update_todo_status(self, list_id, todo_id):
+        # Models a todo deleted between require_todo and the UPDATE.
+        return None
+
+    def set_todos_completed(self, list_id, todo_ids, completed):
+        self.bulk_calls.append((list_id, todo_ids, completed))
+        return len(todo_ids)
+
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.storage = StubStorage()
+        patcher = patch('app.DatabasePersistence', lambda: self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def flash(self, message):
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', message)]
+
+class BulkToggleTest(AppTestCase):
+    url = '/lists/1/todos/bulk_toggle'
+
+    def test_updates_todos(self):
+        response = self.client.post(self.url,
+                                    json={'ids': [1, 2], 'completed': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'updated': 2})
+        self.assertEqual(self.storage.bulk_calls, [(1, [1, 2], True)])
+
+    def test_rejects_invalid_bodies(self):
+        bodies = [
+            {'ids': ['1'], 'completed': True},
+            {'ids': [True], 'completed': True},
+            {'ids': [1.0], 'completed': True},
+            {'ids': 1, 'completed': True},
+            {'ids': [1], 'completed': 1},
+            {'ids': [1]},
+            [1, 2],
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                response = self.client.post(self.url, json=body)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.storage.bulk_calls, [])
+
+    def test_rejects_non_json_body(self):
+        response = self.client.post(self.url, data='ids=1')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_list(self):
+        response = self.client.post('/lists/2/todos/bulk_toggle',
+                                    json={'ids': [1], 'completed': True})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.storage.bulk_calls, [])
+
+class UpdateTodoStatusTest(AppTestCase):
+    def test_todo_deleted_concurrently(self):
+        response = self.client.post('/lists/1/todos/1/toggle')
+        self.assertEqual(response.status_code, 404)
+
+class ConditionalGetTest(AppTestCase):
+    def test_matching_etag_gets_304(self):
+        for url in ['/lists', '/lists/1', '/lists/1/edit']:
+            with self.subTest(url=url):
+                etag = self.client.get(url).headers['ETag']
+                response = self.client.get(url,
+                                           headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+
+    def test_version_change_invalidates_etag(self):
+        for url in ['/lists', '/lists/1']:
+            with self.subTest(url=url):
+                etag = self.client.get(url).headers['ETag']
+                self.storage.lists[1]['version'] += 1
+                response = self.client.get(url,
+                                           headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_lists_etag_follows_the_rendered_rows(self):
+        etag = self.client.get('/lists').headers['ETag']
+        # A stale snapshot is served under its own ETag, never under the
+        # ETag of a newer version.
+        self.storage.lists[1] = dict(self.storage.lists[1], version=2)
+        fresh_etag = self.client.get('/lists').headers['ETag']
+        self.storage.lists[1] = dict(self.storage.lists[1], version=1)
+        response = self.client.get('/lists',
+                                   headers={'If-None-Match': fresh_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_pending_flash_is_rendered_without_etag(self):
+        for url in ['/lists', '/lists/1']:
+            with self.subTest(url=url):
+                etag = self.client.get(url).headers['ETag']
+                self.flash('The todo was added.')
+
+                response = self.client.get(url,
+                                           headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('ETag', response.headers)
+                self.assertIn('The todo was added.',
+                              response.get_data(as_text=True))
+
+                # Shown once; the unchanged page is a 304 again.
+                response = self.client.get(url,
+                                           headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+import os
+import threading
+import unittest
+from unittest.mock import patch
+import psycopg2
+from app import app
+from todos import database_persistence
+from todos.cache import cache
+from todos.database_persistence import DatabasePersistence
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+TEST_SCHEMA = 'todos_test'
+
+@unittest.skipUnless(DATABASE_URL, 'DATABASE_URL is not set')
+class DatabaseTestCase(unittest.TestCase):
+    # Each test gets a fresh schema in the DATABASE_URL database, so the
+    # tables there are never touched.
+    initialize = True
+
+    def setUp(self):
+        self.admin = psycopg2.connect(DATABASE_URL)
+        self.admin.autocommit = True
+        self.addCleanup(self.admin.close)
+        self.sql(f"""
+            DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE;
+            CREATE SCHEMA {TEST_SCHEMA};
+            SET search_path TO {TEST_SCHEMA};
+        """)
+        self.addCleanup(self.sql, f"DROP SCHEMA {TEST_SCHEMA} CASCADE")
+
+        pool = database_persistence._ConnectionPool(
+            1, 2, DATABASE_URL,
+            options=f'-c search_path={TEST_SCHEMA} -c lock_timeout=2s',
+            connection_factory=database_persistence._PreparingConnection)
+        self.addCleanup(pool.closeall)
+        for name, value in [('_connection_pool', lambda: pool),
+                            ('_pool_slots', threading.BoundedSemaphore(2))]:
+            patcher = patch.object(database_persistence, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pool = pool
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        cache.clear()
+
+        if self.initialize:
+            DatabasePersistence.initialize_schema()
+        self.storage = DatabasePersistence()
+
+    def sql(self, query, params=None):
+        with self.admin.cursor() as cursor:
+            cursor.execute(query, params)
+            if cursor.description:
+                return cursor.fetchall()
+            return None
+
+    def create_list(self, title, todo_titles=()):
+        self.storage.create_new_list(title)
+        list_id = self.sql("SELECT id FROM lists WHERE title = %s",
+                           (title,))[0][0]
+        if todo_titles:
+            self.storage.create_todos(list_id, todo_titles)
+        return list_id
+
+    def todo_ids(self, list_id):
+        return [row[0] for row in self.sql(
+            "SELECT id FROM todos WHERE list_id = %s ORDER BY id",
+            (list_id,))]
+
+    def assertCountsMatch(self):
+        rows = self.sql("""
+            SELECT lists.todos_count, lists.pending_count,
+                   COUNT(todos.id),
+                   COUNT(todos.id) FILTER (WHERE NOT todos.completed)
+            FROM lists LEFT JOIN todos ON todos.list_id = lists.id
+            GROUP BY lists.id
+        """)
+        for stored_total, stored_pending, total, pending in rows:
+            self.assertEqual((stored_total, stored_pending), (total, pending))
+
+class TodoCountsTest(DatabaseTestCase):
+    def test_counts_follow_every_kind_of_write(self):
+        groceries = self.create_list('Groceries', ['milk', 'eggs', 'bread'])
+        chores = self.create_list('Chores')
+        self.assertCountsMatch()
+
+        self.storage.create_new_todo(chores, 'dishes')
+        self.assertCountsMatch()
+
+        milk, eggs, bread = self.todo_ids(groceries)
+        self.storage.update_todo_status(groceries, milk)
+        self.assertCountsMatch()
+
+        self.storage.set_todos_completed(groceries, [eggs, bread], True)
+        self.assertCountsMatch()
+        self.storage.set_todos_completed(groceries, [milk, eggs], False)
+        self.assertCountsMatch()
+
+        self.storage.mark_all_todos_completed(chores)
+        self.assertCountsMatch()
+
+        self.storage.delete_todo_from_list(groceries, eggs)
+        self.assertCountsMatch()
+
+        # One statement touching two lists goes through the UPDATE branch
+        # with changes on both sides.
+        self.sql("UPDATE todos SET list_id = %s WHERE id = %s",
+                 (chores, bread))
+        self.assertCountsMatch()
+
+        self.storage.delete_list(chores)
+        self.assertCountsMatch()
+        self.assertEqual(self.sql("SELECT todos_count, pending_count "
+                                  "FROM lists WHERE id = %s",
+                                  (groceries,)),
+                         [(1, 1)])
+
+    def test_all_lists_in_display_order(self):
+        self.create_list('b list', ['x'])
+        done = self.create_list('A done', ['y'])
+        self.storage.mark_all_todos_completed(done)
+        self.create_list('a empty')
+
+        titles = [lst['title'] for lst in self.storage.all_lists()]
+        self.assertEqual(titles, ['a empty', 'b list', 'A done'])
+
+class ListVersionTest(DatabaseTestCase):
+    def version(self, list_id):
+        return self.sql("SELECT version FROM lists WHERE id = %s",
+                        (list_id,))[0][0]
+
+    def test_every_change_bumps_the_version(self):
+        list_id = self.create_list('Groceries')
+        other = self.create_list('Chores', ['dishes'])
+        version = self.version(list_id)
+        other_version = self.version(other)
+
+        def assertBumped():
+            nonlocal version
+            self.assertGreater(self.version(list_id), version)
+            version = self.version(list_id)
+
+        self.storage.update_list_by_id(list_id, 'Shopping')
+        assertBumped()
+        self.storage.create_new_todo(list_id, 'milk')
+        assertBumped()
+        self.storage.create_todos(list_id, ['eggs', 'bread'])
+        assertBumped()
+        milk, eggs, bread = self.todo_ids(list_id)
+        self.storage.update_todo_status(list_id, milk)
+        assertBumped()
+        self.storage.set_todos_completed(list_id, [eggs, bread], True)
+        assertBumped()
+        self.storage.mark_all_todos_completed(list_id)
+        assertBumped()
+        self.storage.delete_todo_from_list(list_id, eggs)
+        assertBumped()
+
+        self.assertEqual(self.version(other), other_version)
+
+    def test_find_list_returns_the_current_version(self):
+        list_id = self.create_list('Groceries')
+        self.assertEqual(self.storage.find_list(list_id)['version'],
+                         self.version(list_id))
+        self.storage.create_new_todo(list_id, 'milk')
+        self.assertEqual(self.storage.find_list(list_id)['version'],
+                         self.version(list_id))
+
+class SchemaSetupTest(DatabaseTestCase):
+    initialize = False
+
+    def columns(self, table):
+        return {row[0] for row in self.sql("""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        """, (table,))}
+
+    def test_migrates_and_backfills_the_original_schema(self):
+        self.sql("""
+            CREATE TABLE lists (
+                id serial PRIMARY KEY,
+                title varchar(100) NOT NULL UNIQUE
+            );
+            CREATE TABLE todos (
+                id serial PRIMARY KEY,
+                title varchar(100) NOT NULL,
+                completed boolean NOT NULL DEFAULT false,
+                list_id integer NOT NULL REFERENCES
+                     lists (id) ON DELETE CASCADE
+            );
+            INSERT INTO lists (title) VALUES ('Groceries'), ('Empty');
+            INSERT INTO todos (list_id, title, completed)
+            VALUES (1, 'milk', false), (1, 'eggs', true);
+        """)
+
+        DatabasePersistence.initialize_schema()
+
+        self.assertEqual(
+            self.sql("SELECT title, todos_count, pending_count, version "
+                     "FROM lists ORDER BY id"),
+            [('Groceries', 2, 1, 1), ('Empty', 0, 0, 1)])
+        self.assertEqual(self.sql("SELECT version FROM schema_version"),
+                         [(database_persistence.SCHEMA_VERSION,)])
+        self.assertCountsMatch()
+
+    def test_migrates_updated_at_to_version(self):
+        DatabasePersistence.initialize_schema()
+        self.sql("""
+            ALTER TABLE lists DROP COLUMN version,
+                ADD COLUMN updated_at timestamptz NOT NULL DEFAULT now();
+            UPDATE schema_version SET version = 1;
+        """)
+
+        DatabasePersistence.initialize_schema()
+
+        columns = self.columns('lists')
+        self.assertIn('version', columns)
+        self.assertNotIn('updated_at', columns)
+        list_id = self.create_list('Groceries', ['milk'])
+        self.assertEqual(self.sql("SELECT version FROM lists WHERE id = %s",
+                                  (list_id,)),
+                         [(2,)])
+
+    def test_up_to_date_schema_takes_no_table_locks(self):
+        DatabasePersistence.initialize_schema()
+        self.create_list('Groceries', ['milk'])
+
+        # An open reader holds ACCESS SHARE locks; any DDL would wait on
+        # them and fail with the pool's lock_timeout.
+        reader = psycopg2.connect(DATABASE_URL,
+                                  options=f'-c search_path={TEST_SCHEMA}')
+        self.addCleanup(reader.close)
+        with reader.cursor() as cursor:
+            cursor.execute("SELECT * FROM lists JOIN todos "
+                           "ON todos.list_id = lists.id")
+            DatabasePersistence.initialize_schema()
+        reader.rollback()
+
+        self.assertEqual(self.sql("SELECT count(*) FROM schema_version"),
+                         [(1,)])
+
+class PreparedStatementTest(DatabaseTestCase):
+    def prepared_on_server(self):
+        connection = self.pool.getconn()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM pg_prepared_statements")
+                names = {row[0] for row in cursor.fetchall()}
+            connection.rollback()
+            return connection.prepared, names
+        finally:
+            self.pool.putconn(connection)
+
+    def test_statements_are_prepared_once_per_connection(self):
+        list_id = self.create_list('Groceries')
+        for title in ['milk', 'eggs']:
+            self.storage.create_new_todo(list_id, title)
+            cache.clear()
+            self.assertEqual(self.storage.find_list(list_id)['title'],
+                             'Groceries')
+
+        tracked, on_server = self.prepared_on_server()
+        self.assertEqual(tracked, on_server)
+        self.assertEqual(tracked, {'create_new_todo', 'find_list',
+                                   'find_todos_for_list'})
+
+    def test_statements_survive_a_rolled_back_transaction(self):
+        list_id = self.create_list('Groceries')
+        # PREPARE runs in the transaction that the failing EXECUTE aborts.
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.storage.create_new_todo(list_id + 1, 'orphan')
+
+        self.storage.create_new_todo(list_id, 'milk')
+        tracked, on_server = self.prepared_on_server()
+        self.assertEqual(tracked, on_server)
+        self.assertEqual(len(self.todo_ids(list_id)), 1)
+
+    def test_statements_survive_added_columns(self):
+        list_id = self.create_list('Groceries', ['milk'])
+        self.storage.find_list(list_id)
+        self.sql("ALTER TABLE lists ADD COLUMN extra integer; "
+                 "ALTER TABLE todos ADD COLUMN extra integer")
+
+        cache.clear()
+        lst = self.storage.find_list(list_id)
+        self.assertEqual(lst['title'], 'Groceries')
+        self.assertEqual([todo['title'] for todo in lst['todos']], ['milk'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from todos.session_persistence import SessionPersistence
+
+class FakeSession(dict):
+    modified = False
+
+class SessionPersistenceTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession()
+        self.storage = SessionPersistence(self.session)
+        self.storage.create_new_list('Groceries')
+        self.list_id = self.session['lists'][0]['id']
+
+    def test_indexes_follow_list_changes(self):
+        self.assertTrue(self.storage.list_exists(self.list_id))
+        self.assertEqual(self.storage.find_list(self.list_id)['title'],
+                         'Groceries')
+
+        self.storage.delete_list(self.list_id)
+        self.assertFalse(self.storage.list_exists(self.list_id))
+        self.assertIsNone(self.storage.find_list(self.list_id))
+        self.assertEqual(self.session['lists'], [])
+
+    def test_indexes_follow_todo_changes(self):
+        self.storage.create_todos(self.list_id, ['milk', 'eggs'])
+        milk, eggs = self.session['lists'][0]['todos']
+
+        self.assertIs(self.storage.find_todo(self.list_id, milk['id']), milk)
+        self.storage.delete_todo_from_list(self.list_id, milk['id'])
+        self.assertIsNone(self.storage.find_todo(self.list_id, milk['id']))
+        self.assertIs(self.storage.find_todo(self.list_id, eggs['id']), eggs)
+        self.assertIsNone(self.storage.find_todo('missing', eggs['id']))
+
+    def test_indexes_are_built_from_existing_session_data(self):
+        storage = SessionPersistence(self.session)
+        self.storage.create_new_todo(self.list_id, 'milk')
+        todo_id = self.session['lists'][0]['todos'][0]['id']
+        self.assertEqual(
+            storage.find_todo(self.list_id, todo_id)['title'], 'milk')
+
+    def test_indexes_stay_out_of_the_session(self):
+        self.storage.create_new_todo(self.list_id, 'milk')
+        self.storage.find_todo(self.list_id, 'missing')
+        self.assertEqual(list(self.session), ['lists'])
+
+    def test_update_todo_status_on_missing_todo(self):
+        self.assertIsNone(
+            self.storage.update_todo_status(self.list_id, 'missing'))
+
+    def test_set_todos_completed_ignores_unknown_ids(self):
+        self.storage.create_todos(self.list_id, ['milk', 'eggs'])
+        milk, eggs = self.session['lists'][0]['todos']
+
+        updated = self.storage.set_todos_completed(
+            self.list_id, [milk['id'], 'missing'], True)
+        self.assertEqual(updated, 1)
+        self.assertTrue(milk['completed'])
+        self.assertFalse(eggs['completed'])
+
+    def test_changes_bump_the_list_version(self):
+        self.storage.create_new_todo(self.list_id, 'milk')
+        self.assertEqual(self.storage.find_list(self.list_id)['version'], 2)
+        self.storage.update_list_by_id(self.list_id, 'Shopping')
+        self.assertEqual(self.storage.all_lists()[0]['version'], 3)
+
+    def test_lists_stored_without_versions_start_at_one(self):
+        session = FakeSession(lists=[{'id': '1', 'title': 't', 'todos': []}])
+        storage = SessionPersistence(session)
+        self.assertEqual(storage.all_lists()[0]['version'], 1)
+
+    def test_all_lists_in_display_order(self):
+        self.storage.create_new_list('apples')
+        self.storage.create_new_list('Done')
+        done_id = self.session['lists'][-1]['id']
+        self.storage.create_new_todo(done_id, 'x')
+        self.storage.mark_all_todos_completed(done_id)
+
+        titles = [lst['title'] for lst in self.storage.all_lists()]
+        self.assertEqual(titles, ['apples', 'Groceries', 'Done'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from todos.utils import (
+    is_list_completed,
+    is_todo_completed,
+    list_stats,
+    sort_items,
+)
+
+class ListStatsTest(unittest.TestCase):
+    def test_counts_todos_without_stored_counts(self):
+        lst = {'todos': [{'completed': True},
+                         {'completed': False},
+                         {'completed': False}]}
+        self.assertEqual(list_stats(lst), (3, 2))
+
+    def test_prefers_stored_counts(self):
+        lst = {'todos_count': 5, 'pending_count': 1}
+        self.assertEqual(list_stats(lst), (5, 1))
+
+    def test_empty_list_is_not_completed(self):
+        self.assertFalse(is_list_completed({'todos': []}))
+        self.assertTrue(is_list_completed({'todos_count': 2,
+                                           'pending_count': 0}))
+
+class SortItemsTest(unittest.TestCase):
+    def test_incomplete_first_then_case_insensitive_title(self):
+        todos = [
+            {'title': 'milk', 'completed': False},
+            {'title': 'Apples', 'completed': True},
+            {'title': 'bread', 'completed': False},
+            {'title': 'Eggs', 'completed': False},
+        ]
+        titles = [todo['title']
+                  for todo in sort_items(todos, is_todo_completed)]
+        self.assertEqual(titles, ['bread', 'Eggs', 'milk', 'Apples'])
+
+    def test_does_not_modify_input(self):
+        todos = [{'title': 'b', 'completed': False},
+                 {'title': 'a', 'completed': False}]
+        sort_items(todos, is_todo_completed)
+        self.assertEqual([todo['title'] for todo in todos], ['b', 'a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,96 +1,235 @@
-import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extensions import connection as Connection
+from psycopg2.extras import RealDictCursor, execute_batch
+from psycopg2.pool import ThreadedConnectionPool
 from contextlib import contextmanager
 import logging
 import os
+import threading
+from todos.cache import cache
 
 LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+# Hot queries are prepared once per pooled connection and then run with
+# EXECUTE, so the server skips parsing and planning on every call. Columns
+# are listed explicitly: a prepared `*` fails with "cached plan must not
+# change result type" once a migration adds a column under live connections.
+PREPARED_STATEMENTS = {
+    'find_list': """
+        SELECT id, title, version, todos_count, pending_count
+        FROM lists WHERE id = $1
+    """,
+    'find_todos_for_list': """
+        SELECT id, list_id, title, completed FROM todos WHERE list_id = $1
+    """,
+    'create_new_todo': """
+        INSERT INTO todos (list_id, title) VALUES ($1, $2)
+    """,
+    'update_todo_status': """
+        UPDATE todos SET completed = NOT completed
+        WHERE list_id = $1 AND id = $2
+        RETURNING completed
+    """,
+}
+
+class _PreparingConnection(Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class _ConnectionPool(ThreadedConnectionPool):
+    # psycopg2 keeps only `minconn` connections idle and closes the rest on
+    # putconn(), so overlapping requests would keep reconnecting. Open
+    # `minconn` up front but keep up to `maxconn` idle for reuse.
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.minconn = self.maxconn
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+def _connection_pool():
+    # Created lazily so that each (forked) worker process opens its own
+    # connections instead of sharing sockets inherited from the parent.
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            min_connections = int(os.environ.get('DB_POOL_MIN', 1))
+            max_connections = int(os.environ.get('DB_POOL_MAX', 20))
+            # getconn() raises once the pool is exhausted; waiting on the
+            # semaphore first makes extra requests (or greenlets) queue.
+            _pool_slots = threading.BoundedSemaphore(max_connections)
+            if os.environ.get('FLASK_ENV') == 'production':
+                _pool = _ConnectionPool(
+                    min_connections, max_connections,
+                    os.environ['DATABASE_URL'],
+                    connection_factory=_PreparingConnection)
+            else:
+                _pool = _ConnectionPool(
+                    min_connections, max_connections, dbname='todos',
+                    connection_factory=_PreparingConnection)
+        return _pool
+
+def _close_connection_pool():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = _pool_slots = None
+
+# schema.sql is the only copy of the DDL. Bump whenever it changes.
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.sql')
+SCHEMA_VERSION = 2
+
+def _list_cache_key(list_id):
+    return f"list:{list_id}"
+
 class DatabasePersistence:
-    def __init__(self):
-        self._setup_schema()
-    
+    @classmethod
+    def initialize_schema(cls):
+        # Runs before workers fork (wsgi.py under --preload), so the pool it
+        # opens is closed again rather than inherited by every worker.
+        try:
+            cls()._setup_schema()
+        finally:
+            _close_connection_pool()
+
     def _setup_schema(self):
+        # One round-trip. The advisory lock serializes concurrent worker
+        # startups without locking any table, and a database already at
+        # SCHEMA_VERSION returns before any DDL, so routine boots never take
+        # the ACCESS EXCLUSIVE locks the migration needs.
+        with open(SCHEMA_PATH) as schema_file:
+            schema = schema_file.read()
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT COUNT(*) FROM information_schema.tables WHERE
-                    table_schema = 'public' AND table_name = 'lists';
-                    """)
-                if cursor.fetchone()[0] == 0:
-                    cursor.execute("""
-                            CREATE TABLE lists (
-                                id serial PRIMARY KEY,
-                                title varchar(100) NOT NULL UNIQUE
-                            );               
-                        """)
-                cursor.execute("""
-                            SELECT COUNT(*) from information_schema.tables
-                            WHERE table_schema = 'public' AND table_name = 'todos';
-                        """)
-                if cursor.fetchone()[0] == 0:
-                    cursor.execute("""
-                            CREATE TABLE todos (
-                            id serial PRIMARY KEY,
-                            title varchar(100) NOT NULL,
-                            completed boolean NOT NULL DEFAULT false,
-                            list_id integer NOT NULL REFERENCES
-                                 lists (id) ON DELETE CASCADE
-                            );
-                        """)
+                cursor.execute(schema, {'version': SCHEMA_VERSION})
+
+    def _invalidate_cache(self, list_id=None):
+        cache.delete('all_lists')
+        if list_id is not None:
+            cache.delete(_list_cache_key(list_id))
     
     @contextmanager
     def _database_connect(self):
-        if os.environ.get('FLASK_ENV') == 'production':
-            connection = psycopg2.connect(os.environ['DATABASE_URL'])
-        else:
-            connection = psycopg2.connect(dbname='todos')
-        try:
-            with connection:
-                yield connection
-        finally:
-            connection.close()
+        pool = _connection_pool()
+        with _pool_slots:
+            connection = pool.getconn()
+            try:
+                with connection:
+                    yield connection
+            finally:
+                pool.putconn(connection)
+
+    def _execute_prepared(self, cursor, name, params):
+        # Prepared statements outlive rolled-back transactions, so the set
+        # stays accurate as long as a name is only added after PREPARE.
+        connection = cursor.connection
+        if name not in connection.prepared:
+            cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+            connection.prepared.add(name)
+        placeholders = ', '.join(['%s'] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
 
-    def _find_todos_for_list(self, list_id):
-        query = "SELECT * FROM todos WHERE list_id = %s"
-        logger.info("Executing query: %s with list_id: %s", query, list_id)
-        with self._database_connect() as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute(query, (list_id,))
-                return cursor.fetchall()
-    
     def all_lists(self):
-        query = "SELECT * FROM lists"
+        # Lists come out in display order: incomplete first, then by title.
+        lists = cache.get('all_lists')
+        if lists is not None:
+            return lists
+
+        query = """
+            SELECT id, title, version, todos_count, pending_count
+            FROM lists
+            ORDER BY todos_count > 0 AND pending_count = 0,
+                     lower(title) COLLATE "C"
+        """
         logger.info("Executing query: %s", query)
         with self._database_connect() as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(query)
-                results = cursor.fetchall()
-        lists = [dict(result) for result in results]
-        for lst in lists:
-            todos = self._find_todos_for_list(lst['id'])
-            lst.setdefault('todos', todos)
+                lists = cursor.fetchall()
+        cache.set('all_lists', lists)
         return lists
-    
+
     def find_list(self, list_id):
-        query = "SELECT * FROM lists WHERE id = %s"
+        key = _list_cache_key(list_id)
+        lst = cache.get(key)
+        if lst is not None:
+            return lst
+
+        logger.info("Executing query: %s and %s with list_id: %s",
+                    PREPARED_STATEMENTS['find_list'],
+                    PREPARED_STATEMENTS['find_todos_for_list'], list_id)
+        with self._database_connect() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                # One snapshot for the list row and its todos.
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL "
+                               "REPEATABLE READ, READ ONLY")
+                self._execute_prepared(cursor, 'find_list', (list_id,))
+                lst = cursor.fetchone()
+                if lst is None:
+                    return None
+                self._execute_prepared(cursor, 'find_todos_for_list',
+                                       (list_id,))
+                lst['todos'] = cursor.fetchall()
+                conn.commit()
+
+                if not cache.add(key, lst):
+                    return lst
+                # A write that committed after the snapshot may already have
+                # cleared the key; if so, drop the stale copy just stored.
+                cursor.execute("SELECT version FROM lists WHERE id = %s",
+                               (list_id,))
+                current = cursor.fetchone()
+                if current is None or current['version'] != lst['version']:
+                    cache.delete(key)
+        return lst
+
+    def list_title_exists(self, title):
+        query = "SELECT 1 FROM lists WHERE title = %s"
+        logger.info("Executing query: %s with title: %s", query, title)
+        with self._database_connect() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (title,))
+                return cursor.fetchone() is not None
+
+    def list_exists(self, list_id):
+        if cache.get(_list_cache_key(list_id)) is not None:
+            return True
+
+        query = "SELECT EXISTS (SELECT 1 FROM lists WHERE id = %s)"
         logger.info("Executing query: %s with list_id: %s", query, list_id)
         with self._database_connect() as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
+            with conn.cursor() as cursor:
                 cursor.execute(query, (list_id,))
-                lst = dict(cursor.fetchone())
-        todos = self._find_todos_for_list(list_id)
-        lst.setdefault('todos', todos)
-        return lst
-    
+                return cursor.fetchone()[0]
+
+    def find_todo(self, list_id, todo_id):
+        query = "SELECT * FROM todos WHERE id = %s AND list_id = %s"
+        logger.info("Executing query: %s with todo_id: %s and list_id: %s",
+                    query, todo_id, list_id,)
+        with self._database_connect() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, (todo_id, list_id,))
+                return cursor.fetchone()
+
     def create_new_list(self, title):
-        query = "INSERT INTO lists (title) VALUES (%s);"
+        query = """
+            INSERT INTO lists (title) VALUES (%s)
+            RETURNING id, title, version, todos_count, pending_count
+        """
         logger.info("Executing query: %s with title: %s", query, title)
         with self._database_connect() as conn:
-            with conn.cursor() as cursor:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(query, (title,))
+                lst = cursor.fetchone()
+        # The new row is all find_list needs, so opening it is a cache hit.
+        lst['todos'] = []
+        cache.set(_list_cache_key(lst['id']), lst)
+        cache.delete('all_lists')
 
     def update_list_by_id(self, list_id, new_title):
         query = "UPDATE lists SET title = %s WHERE id = %s"
@@ -99,6 +238,7 @@ class DatabasePersistence:
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query, (new_title, list_id,))
+        self._invalidate_cache(list_id)
 
     def delete_list(self, list_id):
         query = "DELETE FROM lists WHERE id = %s"
@@ -106,34 +246,72 @@ class DatabasePersistence:
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query, (list_id,))
+        self._invalidate_cache(list_id)
 
     def create_new_todo(self, list_id, todo_title):
-        query = "INSERT INTO todos (list_id, title) VALUES (%s, %s)"
+        query = PREPARED_STATEMENTS['create_new_todo']
         logger.info("Executing query: %s with list_id: %s and title: %s", 
                     query, list_id, todo_title,)
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (list_id, todo_title,))
+                self._execute_prepared(cursor, 'create_new_todo',
+                                       (list_id, todo_title,))
+        self._invalidate_cache(list_id)
     
+    def create_todos(self, list_id, todo_titles):
+        query = "INSERT INTO todos (list_id, title) VALUES (%s, %s)"
+        logger.info("Executing query: %s with list_id: %s and titles: %s",
+                    query, list_id, todo_titles,)
+        with self._database_connect() as conn:
+            with conn.cursor() as cursor:
+                execute_batch(cursor, query,
+                              [(list_id, title) for title in todo_titles],
+                              page_size=100)
+        self._invalidate_cache(list_id)
+
+    # require_todo has already checked that the todo belongs to list_id.
     def delete_todo_from_list(self, list_id, todo_id):
-        query = "DELETE FROM todos WHERE list_id = %s AND id = %s"
-        logger.info("Executing query: %s with list_id: %s and todo_id: %s", 
+        query = "DELETE FROM todos WHERE id = %s"
+        logger.info("Executing query: %s with todo_id: %s", query, todo_id,)
+        with self._database_connect() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (todo_id,))
+        self._invalidate_cache(list_id)
+
+    def update_todo_status(self, list_id, todo_id):
+        query = PREPARED_STATEMENTS['update_todo_status']
+        logger.info("Executing query: %s with list_id: %s and todo_id: %s",
                     query, list_id, todo_id,)
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (list_id, todo_id,))
+                self._execute_prepared(cursor, 'update_todo_status',
+                                       (list_id, todo_id,))
+                row = cursor.fetchone()
+        # No row means the todo was deleted after require_todo found it.
+        if row is None:
+            return None
+
+        self._invalidate_cache(list_id)
+        return row[0]
 
-    def update_todo_status(self, list_id, todo_id, new_status):
-        query = "UPDATE todos SET completed = %s WHERE list_id = %s and id = %s"
-        logger.info("Executing query: %s with status: %s and list_id:%s and todo_id: %s",
-                    query, new_status, list_id, todo_id,)
+    def set_todos_completed(self, list_id, todo_ids, completed):
+        query = """
+            UPDATE todos SET completed = %s
+            WHERE list_id = %s AND id = ANY(%s)
+        """
+        logger.info("Executing query: %s with status: %s and list_id: %s and todo_ids: %s",
+                    query, completed, list_id, todo_ids,)
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (new_status, list_id, todo_id,))
+                cursor.execute(query, (completed, list_id, list(todo_ids),))
+                updated = cursor.rowcount
+        self._invalidate_cache(list_id)
+        return updated
 
     def mark_all_todos_completed(self, list_id):
         query = "UPDATE todos SET completed = True WHERE list_id = %s"
         logger.info("Executing query: %s with list_id: %s", query, list_id,)
         with self._database_connect() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(query, (list_id,))
\ No newline at end of file
+                cursor.execute(query, (list_id,))
+        self._invalidate_cache(list_id)
@@ -1,59 +1,123 @@
 from uuid import uuid4
+from todos.utils import is_list_completed, sort_items
 
 class SessionPersistence:
     def __init__(self, session):
         self.session = session
         if 'lists' not in self.session:
             self.session['lists'] = []
-    
+        # Id indexes over the session data. They live on the instance, not
+        # in the session, so they never end up in the serialized cookie.
+        self._lists_by_id = None
+        self._todos_by_id = {}
+
+    def _list_index(self):
+        if self._lists_by_id is None:
+            self._lists_by_id = {}
+            for lst in self.session['lists']:
+                # Lists stored before versions existed start at 1.
+                lst.setdefault('version', 1)
+                self._lists_by_id[lst['id']] = lst
+        return self._lists_by_id
+
+    def _touch(self, lst):
+        # Mirrors the database trigger: any change to a list or its todos
+        # bumps the list's version, which the ETags are built from.
+        lst['version'] += 1
+        self.session.modified = True
+
+    def _todo_index(self, lst):
+        index = self._todos_by_id.get(lst['id'])
+        if index is None:
+            index = {todo['id']: todo for todo in lst['todos']}
+            self._todos_by_id[lst['id']] = index
+        return index
+
     def find_list(self, list_id):
-        found = (lst for lst in self.session['lists'] if lst['id'] == list_id)
-        return next(found, None)
-    
+        return self._list_index().get(list_id)
+
+    def list_exists(self, list_id):
+        return list_id in self._list_index()
+
+    def find_todo(self, list_id, todo_id):
+        lst = self.find_list(list_id)
+        if not lst:
+            return None
+        return self._todo_index(lst).get(todo_id)
+
     def all_lists(self):
-        return self.session['lists']
-    
+        return sort_items(self._list_index().values(), is_list_completed)
+
+    def list_title_exists(self, title):
+        return any(lst['title'] == title for lst in self.session['lists'])
+
     def create_new_list(self, title):
-        lists = self.all_lists()
-        lists.append({
+        lst = {
             'id': str(uuid4()),
             'title': title,
+            'version': 1,
             'todos': [],
-        })
+        }
+        self.session['lists'].append(lst)
+        self._list_index()[lst['id']] = lst
         self.session.modified = True
 
     def update_list_by_id(self, id, new_title):
         lst = self.find_list(id)
         if lst:
             lst['title'] = new_title
-            self.session.modified = True
+            self._touch(lst)
 
     def delete_list(self, id):
-        self.session['lists'] = [lst for lst in self.session['lists'] if lst['id'] != id]
-        self.session.modified = True
+        lst = self._list_index().pop(id, None)
+        if lst:
+            self.session['lists'].remove(lst)
+            self._todos_by_id.pop(id, None)
+            self.session.modified = True
 
     def create_new_todo(self, list_id, todo_title):
         lst = self.find_list(list_id)
-        lst['todos'].append({
+        todo = {
             'id': str(uuid4()),
             'title': todo_title,
             'completed': False,
-        })
-        self.session.modified = True
-    
+        }
+        lst['todos'].append(todo)
+        self._todo_index(lst)[todo['id']] = todo
+        self._touch(lst)
+
+    def create_todos(self, list_id, todo_titles):
+        for todo_title in todo_titles:
+            self.create_new_todo(list_id, todo_title)
+
     def delete_todo_from_list(self, list_id, todo_id):
         lst = self.find_list(list_id)
-        lst['todos'] = [todo for todo in lst['todos'] if todo['id'] != todo_id]
-        self.session.modified = True
+        todo = self._todo_index(lst).pop(todo_id, None)
+        if todo:
+            lst['todos'].remove(todo)
+            self._touch(lst)
 
-    def update_todo_status(self, list_id, todo_id, new_status):
-        lst = self.find_list(list_id)
-        todo = next((td for td in lst['todos'] if td['id'] == todo_id))
-        todo['completed'] = new_status
-        self.session.modified = True
+    def update_todo_status(self, list_id, todo_id):
+        todo = self.find_todo(list_id, todo_id)
+        if not todo:
+            return None
+        todo['completed'] = not todo['completed']
+        self._touch(self.find_list(list_id))
+        return todo['completed']
+
+    def set_todos_completed(self, list_id, todo_ids, completed):
+        updated = 0
+        for todo_id in todo_ids:
+            todo = self.find_todo(list_id, todo_id)
+            if todo:
+                todo['completed'] = completed
+                updated += 1
+        if updated:
+            self._touch(self.find_list(list_id))
+        return updated
 
     def mark_all_todos_completed(self, list_id):
         lst = self.find_list(list_id)
         for todo in lst['todos']:
             todo['completed'] = True
-        self.session.modified = True
\ No newline at end of file
+        self._touch(lst)
@@ -1,10 +1,11 @@
 
 
-def error_for_list_title(title, lists):
-    if any(lst['title'] == title for lst in lists):
-        return "The title must be unique."
-    elif not 1 <= len(title) <= 100:
+def error_for_list_title(title, storage):
+    # Validate the length first so invalid titles never hit the database.
+    if not 1 <= len(title) <= 100:
         return "The title must be between 1 and 100 characters"
+    elif storage.list_title_exists(title):
+        return "The title must be unique."
     else:
         return None
 
@@ -14,25 +15,28 @@ def error_for_todo(title):
 
     return None
 
-def find_todo_by_id(todo_id, todos):
-    return next((todo for todo in todos if todo['id'] == todo_id), None)
+def list_stats(lst):
+    # Lists loaded from the database carry counts maintained by triggers;
+    # otherwise count the todos in a single pass.
+    if 'todos_count' in lst:
+        return lst['todos_count'], lst['pending_count']
+
+    total = remaining = 0
+    for todo in lst['todos']:
+        total += 1
+        if not todo['completed']:
+            remaining += 1
+    return total, remaining
 
 def is_list_completed(lst):
-    return len(lst['todos']) > 0 and todos_remaining(lst) == 0
+    total, remaining = list_stats(lst)
+    return total > 0 and remaining == 0
 
 def is_todo_completed(todo):
     return todo['completed']
 
 
 def sort_items(items, select_completed):
-    sorted_items = sorted(items, key=lambda item: item['title'].lower())
-
-    incomplete_items = [item for item in sorted_items
-                        if not select_completed(item)]
-    complete_items = [item for item in sorted_items
-                      if select_completed(item)]
-
-    return incomplete_items + complete_items
-
-def todos_remaining(lst):
-    return sum(1 for todo in lst['todos'] if not todo['completed'])
+    # Incomplete items first, then by title; one stable sort on a tuple key.
+    return sorted(items, key=lambda item: (bool(select_completed(item)),
+                                           item['title'].lower()))
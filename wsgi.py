@@ -1,4 +1,18 @@
+# Patch the standard library and libpq before anything imports psycopg2, so
+# that database waits yield to other greenlets under the gevent worker.
+from gevent import monkey
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
 from app import app
+from todos.database_persistence import DatabasePersistence
+
+# Once per worker boot, or once in the master under --preload; a database
+# already at the current schema version skips the DDL entirely. The setup
+# closes its connections, so workers always open their own.
+DatabasePersistence.initialize_schema()
 
 if __name__ == "__main__":
     app.run()